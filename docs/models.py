@@ -16,7 +16,7 @@ from django.contrib.postgres.search import (
 )
 from django.core.cache import cache
 from django.db import models, transaction
-from django.db.models import Prefetch, Q
+from django.db.models import Q
 from django.db.models.fields.json import KeyTextTransform
 from django.utils.functional import cached_property
 from django.utils.html import strip_tags
@@ -57,7 +57,7 @@ class DocumentReleaseManager(models.Manager):
         return current_version
 
     def by_version(self, version):
-        return self.filter(
+        return self.select_related("release").filter(
             **{"release__isnull": True} if version == "dev" else {"release": version}
         )
 
@@ -145,6 +145,13 @@ class DocumentRelease(models.Model):
         eol_date = latest_release.eol_date
         return eol_date is None or eol_date > datetime.date.today()
 
+    @property
+    def config(self):
+        """
+        Return the text search configuration used for this release's documents.
+        """
+        return TSEARCH_CONFIG_LANGUAGES.get(self.lang[:2], DEFAULT_TEXT_SEARCH_CONFIG)
+
     @property
     def scm_url(self):
         url = "https://github.com/django/django.git"
@@ -172,6 +179,7 @@ class DocumentRelease(models.Model):
                 if line.startswith(f"Disallow: /{self.lang}/{self.release_id}/")
             ]
 
+        documents = []
         for document in decoded_documents:
             if (
                 "body" not in document
@@ -185,15 +193,16 @@ class DocumentRelease(models.Model):
             document_path = _clean_document_path(document["current_page_name"])
             document["slug"] = Path(document_path).parts[-1]
             document["parents"] = " ".join(Path(document_path).parts[:-1])
-            Document.objects.create(
-                release=self,
-                path=document_path,
-                title=html.unescape(strip_tags(document["title"])),
-                metadata=document,
-                config=TSEARCH_CONFIG_LANGUAGES.get(
-                    self.lang[:2], DEFAULT_TEXT_SEARCH_CONFIG
-                ),
+            documents.append(
+                Document(
+                    release=self,
+                    path=document_path,
+                    title=html.unescape(strip_tags(document["title"])),
+                    metadata=document,
+                    config=self.config,
+                )
             )
+        Document.objects.bulk_create(documents, batch_size=500)
         for document in self.documents.all():
             document.metadata["breadcrumbs"] = list(
                 Document.objects.breadcrumbs(document).values("title", "path")
@@ -246,21 +255,14 @@ class DocumentQuerySet(models.QuerySet):
         """Use full-text search to return documents matching query_text."""
         query_text = query_text.strip()
         if query_text:
+            # A constant config lets PostgreSQL use the GIN index on "search".
             search_query = SearchQuery(
-                query_text, config=models.F("config"), search_type="websearch"
+                query_text, config=release.config, search_type="websearch"
             )
             search_rank = SearchRank(models.F("search"), search_query)
             similarity = TrigramSimilarity("title", query_text)
             return (
-                self.prefetch_related(
-                    Prefetch(
-                        "release",
-                        queryset=DocumentRelease.objects.only("lang", "release"),
-                    ),
-                    Prefetch(
-                        "release__release", queryset=Release.objects.only("version")
-                    ),
-                )
+                self.select_related("release__release")
                 .filter(
                     release_id=release.id,
                     search=search_query,
@@ -286,7 +288,9 @@ class DocumentQuerySet(models.QuerySet):
                 .order_by("-rank")
                 .only(
                     "path",
-                    "release",
+                    "title",
+                    "release__lang",
+                    "release__release__version",
                 )
             )
         else:
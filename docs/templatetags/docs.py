@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from django import template
 from django.utils.safestring import mark_safe
 from django.utils.version import get_version_tuple
@@ -49,6 +51,14 @@ def get_all_doc_versions(context, url=None):
     return [".".join([str(part) for part in x]) for x in versions] + ["dev"]
 
 
+@lru_cache
+def _get_lexer(lexer_name):
+    return get_lexer_by_name(lexer_name)
+
+
+_html_formatter = HtmlFormatter()
+
+
 class PygmentsNode(template.Node):
     def __init__(self, lexer_name, nodelist):
         self.nodelist = nodelist
@@ -57,8 +67,7 @@ class PygmentsNode(template.Node):
     def render(self, context):
         content = self.nodelist.render(context)
         lexer_name = self.lexer_name.resolve(context)
-        lexer = get_lexer_by_name(lexer_name)
-        output = highlight(content, lexer, HtmlFormatter())
+        output = highlight(content, _get_lexer(lexer_name), _html_formatter)
         return mark_safe(output)
 
 